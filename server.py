@@ -10,11 +10,39 @@ import subprocess
 import tempfile
 import os
 import socket
+import hashlib
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import hmac
+import json
+import secrets
+import shutil
+import struct
+import threading
+import time
+import urllib.parse
+import urllib.request
 import platform
+import sys
 from datetime import datetime
 
 PORT = 8765
 SYSTEM = platform.system()  # 'Darwin' for Mac, 'Windows' for Windows
+STAGE_TTL = 300  # Seconds an uploaded-but-not-sent photo is kept
+PROBE_MAX_BYTES = 8 * 1024 * 1024  # Largest network probe the phone may send or ask for
+HISTORY_LENGTH = 50  # Recent pastes remembered per phone
+PAIRING_ATTEMPTS = 5  # Wrong codes in a row before pairing locks until restart
+PAIRING_WINDOW = 600  # Seconds a pairing code stays valid (it also ends once a phone pairs)
+DEVICES_FILE = os.path.join(os.path.expanduser('~'), '.phonecamerapaster_devices.json')
+
+# Post-processing, e.g. PASTER_PIPELINE="strip_metadata,archive,ocr:after:120"
+# (name[:before|after[:timeout seconds]], see STAGES below)
+PIPELINE_SPEC = os.environ.get('PASTER_PIPELINE', '')
+ARCHIVE_DIR = os.environ.get('PASTER_ARCHIVE_DIR',
+                             os.path.join(os.path.expanduser('~'), 'Pictures', 'Phone Camera Paster'))
+WEBHOOK_URL = os.environ.get('PASTER_WEBHOOK_URL', 'http://127.0.0.1:8766/paste')
+STAGE_WORKERS = 4
 
 
 def copy_image_to_clipboard(image_path):
@@ -105,49 +133,1126 @@ def copy_image_to_clipboard(image_path):
     except Exception as e:
         return False, str(e)
 
-class ClipboardHandler(http.server.BaseHTTPRequestHandler):
-    def do_POST(self):
-        try:
-            # Get content length
-            content_length = int(self.headers.get('Content-Length', 0))
+
+def read_clipboard_image(image_path):
+    """Save the clipboard image as a PNG. Returns (success, error_message)."""
+    try:
+        if SYSTEM == 'Darwin':  # macOS
+            applescript = f'''
+            set pngData to the clipboard as «class PNGf»
+            set theFile to open for access POSIX file "{image_path}" with write permission
+            set eof theFile to 0
+            write pngData to theFile
+            close access theFile
+            '''
+            result = subprocess.run(
+                ['osascript', '-e', applescript],
+                capture_output=True,
+                text=True
+            )
+            if result.returncode == 0:
+                return True, None
+            return False, "No image on the clipboard"
             
-            if content_length == 0:
-                self.send_error(400, "No image data received")
-                return
+        elif SYSTEM == 'Windows':
+            ps_script = f'''
+            Add-Type -AssemblyName System.Windows.Forms
+            $image = [System.Windows.Forms.Clipboard]::GetImage()
+            if ($image -eq $null) {{ exit 2 }}
+            $image.Save("{image_path}", [System.Drawing.Imaging.ImageFormat]::Png)
+            '''
+            result = subprocess.run(
+                ['powershell', '-Command', ps_script],
+                capture_output=True,
+                text=True
+            )
+            if result.returncode == 0:
+                return True, None
+            if result.returncode == 2:
+                return False, "No image on the clipboard"
+            return False, result.stderr
             
-            # Read the image data
-            image_data = self.rfile.read(content_length)
+        elif SYSTEM == 'Linux':
+            try:
+                with open(image_path, 'wb') as f:
+                    result = subprocess.run(
+                        ['xclip', '-selection', 'clipboard', '-t', 'image/png', '-o'],
+                        stdout=f,
+                        stderr=subprocess.PIPE
+                    )
+                if result.returncode == 0 and os.path.getsize(image_path) > 0:
+                    return True, None
+                return False, "No image on the clipboard"
+            except FileNotFoundError:
+                return False, "Install xclip: sudo apt install xclip"
             
-            # Save to temp file
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            temp_path = os.path.join(tempfile.gettempdir(), f"clipboard_photo_{timestamp}.png")
+        else:
+            return False, f"Unsupported OS: {SYSTEM}"
             
-            with open(temp_path, 'wb') as f:
-                f.write(image_data)
+    except Exception as e:
+        return False, str(e)
+
+
+def clipboard_change_count():
+    """Counter that changes whenever the clipboard does, or None if the OS has none"""
+    try:
+        if SYSTEM == 'Darwin':
+            result = subprocess.run(
+                ['osascript', '-e', 'use framework "AppKit"',
+                 '-e', "current application's NSPasteboard's generalPasteboard()'s changeCount()"],
+                capture_output=True,
+                text=True
+            )
+            if result.returncode == 0:
+                return int(result.stdout.strip())
+        elif SYSTEM == 'Windows':
+            import ctypes
+            return ctypes.windll.user32.GetClipboardSequenceNumber()
+    except Exception:
+        pass
+    # Linux has no change counter; the image is re-read and compared by hash
+    return None
+
+
+# Last clipboard image pulled by the phone, so an unchanged clipboard
+# is never exported again: {'counter', 'path', 'etag'}
+clipboard_cache = {}
+stale_exports = []  # Old exports Windows wouldn't delete while still being sent
+clipboard_cache_lock = threading.Lock()
+
+
+def get_clipboard_image():
+    """Current clipboard image, opened for reading. Returns (file, etag, error_message).
+
+    The file is opened under the lock, so a newer pull replacing the export
+    can't delete it out from under a send in progress. The caller closes it.
+    """
+    counter = clipboard_change_count()
+    with clipboard_cache_lock:
+        if counter is not None and clipboard_cache.get('counter') == counter:
+            return open(clipboard_cache['path'], 'rb'), clipboard_cache['etag'], None
+        
+        temp_path = os.path.join(tempfile.gettempdir(), f"clipboard_pull_{secrets.token_hex(8)}.png")
+        success, error = read_clipboard_image(temp_path)
+        if not success:
+            remove_file(temp_path)
+            return None, None, error
+        
+        digest = hashlib.sha256()
+        with open(temp_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+        etag = '"' + digest.hexdigest()[:32] + '"'
+        
+        if clipboard_cache.get('etag') == etag:
+            remove_file(temp_path)
+        else:
+            if clipboard_cache:
+                stale_exports.append(clipboard_cache['path'])
+            clipboard_cache['path'] = temp_path
+            clipboard_cache['etag'] = etag
+            # POSIX unlinks files that are still open; Windows refuses, so retry later
+            for path in stale_exports[:]:
+                remove_file(path)
+                if not os.path.exists(path):
+                    stale_exports.remove(path)
+        clipboard_cache['counter'] = counter
+        return open(clipboard_cache['path'], 'rb'), etag, None
+
+
+def parse_range(range_header, size):
+    """Parse a single 'bytes=start-end' range. Returns (start, end), None if
+    unsatisfiable, or (0, size - 1) for anything we don't split (e.g. multiple ranges)."""
+    units, _, spec = range_header.partition('=')
+    if units.strip() != 'bytes' or ',' in spec:
+        return 0, size - 1
+    start, _, end = spec.strip().partition('-')
+    try:
+        if start == '':
+            length = int(end)
+            if length == 0:
+                return None
+            return max(0, size - length), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return 0, size - 1
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def transform_image(image_path, rotation=0, crop=None):
+    """Crop (first) and rotate an image into a new PNG. Returns (new_path, error_message)."""
+    out_path = image_path + '.edit.png'
+    try:
+        # ImageMagick works everywhere it is installed and honours EXIF orientation,
+        # which is what the phone's crop coordinates are relative to
+        magick = shutil.which('magick') or (shutil.which('convert') if SYSTEM != 'Windows' else None)
+        if magick:
+            cmd = [magick, image_path, '-auto-orient']
+            if crop:
+                cmd += ['-crop', f"{crop['width']}x{crop['height']}+{crop['x']}+{crop['y']}", '+repage']
+            if rotation:
+                cmd += ['-rotate', str(rotation)]
+            cmd.append(f'png:{out_path}')
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            if result.returncode == 0:
+                return out_path, None
+            return None, result.stderr
+
+        if SYSTEM == 'Windows':
+            # System.Drawing ignores EXIF orientation, so apply it before cropping
+            crop_script = ''
+            if crop:
+                crop_script = f'''
+            $rect = New-Object System.Drawing.Rectangle({crop['x']}, {crop['y']}, {crop['width']}, {crop['height']})
+            $bitmap = $bitmap.Clone($rect, $bitmap.PixelFormat)
+            '''
+            rotate_script = f"$bitmap.RotateFlip('Rotate{rotation}FlipNone')" if rotation else ''
+            ps_script = f'''
+            Add-Type -AssemblyName System.Drawing
+            $image = [System.Drawing.Image]::FromFile("{image_path}")
+            $bitmap = New-Object System.Drawing.Bitmap($image)
+            if ($image.PropertyIdList -contains 0x0112) {{
+                $flips = @{{ 2='RotateNoneFlipX'; 3='Rotate180FlipNone'; 4='Rotate180FlipX'; 5='Rotate90FlipX'; 6='Rotate90FlipNone'; 7='Rotate270FlipX'; 8='Rotate270FlipNone' }}
+                $orientation = [int]$image.GetPropertyItem(0x0112).Value[0]
+                if ($flips.ContainsKey($orientation)) {{ $bitmap.RotateFlip($flips[$orientation]) }}
+            }}
+            {crop_script}
+            {rotate_script}
+            $bitmap.Save("{out_path}", [System.Drawing.Imaging.ImageFormat]::Png)
+            '''
+            result = subprocess.run(
+                ['powershell', '-Command', ps_script],
+                capture_output=True,
+                text=True
+            )
+            if result.returncode == 0:
+                return out_path, None
+            return None, result.stderr
+
+        return None, "Install ImageMagick to edit photos on this computer"
+
+    except Exception as e:
+        return None, str(e)
+
+
+# Photos uploaded in the background while the user is still editing,
+# waiting for Send: upload id -> (temp path, time staged)
+staged_uploads = {}
+staged_lock = threading.Lock()
+
+
+def stage_upload(device, image_data):
+    """Save an uploaded photo until it is committed. Returns its upload id."""
+    upload_id = secrets.token_hex(8)
+    temp_path = os.path.join(tempfile.gettempdir(), f"clipboard_staged_{upload_id}.png")
+    with open(temp_path, 'wb') as f:
+        f.write(image_data)
+    with staged_lock:
+        staged_uploads[upload_id] = (temp_path, time.time(), device.token)
+    return upload_id
+
+
+def take_staged_upload(device, upload_id):
+    """Remove a device's staged photo from the table and return its path (None if unknown/expired)."""
+    with staged_lock:
+        entry = staged_uploads.get(upload_id)
+        if entry is None or entry[2] != device.token:
+            return None
+        del staged_uploads[upload_id]
+    if time.time() - entry[1] > STAGE_TTL:
+        remove_file(entry[0])
+        return None
+    return entry[0]
+
+
+def expire_staged_uploads():
+    """Delete staged photos that were never sent"""
+    cutoff = time.time() - STAGE_TTL
+    with staged_lock:
+        expired = [upload_id for upload_id, (_, staged_at, _) in staged_uploads.items() if staged_at < cutoff]
+        paths = [staged_uploads.pop(upload_id)[0] for upload_id in expired]
+    for path in paths:
+        remove_file(path)
+    if paths:
+        print(f"🧹 Expired {len(paths)} unsent photo(s)")
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class Device:
+    """A paired phone, with its own queue of photos waiting for the clipboard and its history"""
+    
+    def __init__(self, token, name):
+        self.token = token
+        self.name = name
+        self.queue = collections.deque()
+        self.history = collections.deque(maxlen=HISTORY_LENGTH)
+
+
+class CommitJob:
+    """One photo waiting for its turn on the clipboard"""
+    
+    def __init__(self, image_path, size):
+        self.image_path = image_path
+        self.size = size
+        self.queued_at = time.time()
+        self.done = threading.Event()
+        self.success = False
+        self.error = None
+
+
+# Paired phones by token; the condition also wakes the clipboard committer
+devices = {}
+devices_lock = threading.Condition()
+commit_cursor = 0
+pairing = {'code': None, 'expires': 0, 'failures': 0}
+devices_file_mtime = {'seen': None}
+
+
+def new_pairing_code():
+    # Failures are not reset here, so asking for new codes doesn't lift the lockout
+    pairing['code'] = f"{secrets.randbelow(10 ** 6):06d}"
+    pairing['expires'] = time.time() + PAIRING_WINDOW
+    return pairing['code']
+
+
+def request_pairing_code():
+    """Print a fresh code for an unpaired phone if none is active. Returns an error message or None."""
+    with devices_lock:
+        if pairing['failures'] >= PAIRING_ATTEMPTS:
+            return "Pairing locked after too many wrong codes"
+        if pairing['code'] is not None and time.time() <= pairing['expires']:
+            return None
+        code = new_pairing_code()
+    print(f"🔑 New pairing code: {code} (pairs one phone, valid {PAIRING_WINDOW // 60} min)")
+    return None
+
+
+def sync_devices():
+    """Load DEVICES_FILE again if it changed, e.g. after `server.py --unpair`.
+    Phones removed from the file lose access at once."""
+    with devices_lock:
+        try:
+            mtime = os.stat(DEVICES_FILE).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == devices_file_mtime['seen']:
+            return
+        
+        try:
+            with open(DEVICES_FILE) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            saved = {}
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Could not read paired phones: {e}")
+            return
+        devices_file_mtime['seen'] = mtime
+        
+        for token in [token for token in devices if token not in saved]:
+            device = devices.pop(token)
+            # Nobody will take these turns now, so release their waiting requests
+            for job in device.queue:
+                job.error = "Phone unpaired"
+                job.done.set()
+            device.queue.clear()
+            print(f"🔌 Unpaired {device.name}")
+        for token, name in saved.items():
+            if token not in devices:
+                devices[token] = Device(token, name)
+
+
+def save_devices():
+    """Write the paired phones' tokens, readable only by this user"""
+    with devices_lock:
+        saved = {token: device.name for token, device in devices.items()}
+        try:
+            fd = os.open(DEVICES_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            os.chmod(DEVICES_FILE, 0o600)  # Tighten files saved by older versions too
+            with os.fdopen(fd, 'w') as f:
+                json.dump(saved, f)
+            devices_file_mtime['seen'] = os.stat(DEVICES_FILE).st_mtime_ns
+        except OSError as e:
+            print(f"⚠️  Could not save paired phones: {e}")
+
+
+def next_device_name():
+    numbers = [int(device.name.split()[-1]) for device in devices.values()
+               if device.name.startswith('Phone ') and device.name.split()[-1].isdigit()]
+    return f"Phone {max(numbers, default=0) + 1}"
+
+
+def pair_device(code):
+    """Pair a phone that knows the current code. Returns (Device, None) or (None, error_message).
+
+    Each code pairs one phone within PAIRING_WINDOW, and PAIRING_ATTEMPTS wrong
+    guesses in a row lock pairing until the server restarts.
+    """
+    sync_devices()
+    with devices_lock:
+        if pairing['failures'] >= PAIRING_ATTEMPTS:
+            return None, "Pairing locked after too many wrong codes"
+        if pairing['code'] is None or time.time() > pairing['expires']:
+            pairing['code'] = None
+            return None, "Pairing code expired"
+        if not hmac.compare_digest(str(code).encode('utf-8'), pairing['code'].encode('utf-8')):
+            pairing['failures'] += 1
+            if pairing['failures'] >= PAIRING_ATTEMPTS:
+                pairing['code'] = None
+                print("🔒 Too many wrong pairing codes. Restart the server to pair a phone.")
+            return None, "Wrong pairing code"
+        pairing['code'] = None
+        pairing['failures'] = 0
+        token = secrets.token_urlsafe(24)
+        device = Device(token, next_device_name())
+        devices[token] = device
+        save_devices()
+    return device, None
+
+
+def find_device(token):
+    sync_devices()
+    with devices_lock:
+        return devices.get(token) if token else None
+
+
+def submit_commit(device, image_path, size):
+    """Queue a photo for the clipboard and return its job (wait on job.done)"""
+    job = CommitJob(image_path, size)
+    with devices_lock:
+        device.queue.append(job)
+        devices_lock.notify()
+    return job
+
+
+def next_commit_job():
+    """Round-robin over phones with queued photos, one photo per phone per turn"""
+    global commit_cursor
+    order = list(devices.values())
+    for offset in range(len(order)):
+        index = (commit_cursor + offset) % len(order)
+        if order[index].queue:
+            commit_cursor = index + 1
+            return order[index], order[index].queue.popleft()
+    return None, None
+
+
+def commit_loop():
+    """The only writer of the clipboard, so a burst from one phone can't starve the others"""
+    while True:
+        with devices_lock:
+            device, job = next_commit_job()
+            while job is None:
+                devices_lock.wait()
+                device, job = next_commit_job()
+        
+        job.success, job.error = copy_image_to_clipboard(job.image_path)
+        wait_ms = (time.time() - job.queued_at) * 1000
+        with devices_lock:
+            device.history.append({
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'bytes': job.size,
+                'ok': job.success,
+                'wait_ms': round(wait_ms),
+            })
+        job.done.set()
+
+
+def copy_text_to_clipboard(text, info):
+    """Put text where it won't replace the pasted photo. Returns where it went."""
+    if SYSTEM == 'Linux':
+        # The primary selection (middle-click paste) is separate from the clipboard
+        try:
+            result = subprocess.run(
+                ['xclip', '-selection', 'primary', '-i'],
+                input=text.encode('utf-8'),
+                capture_output=True,
+                timeout=5
+            )
+            if result.returncode == 0:
+                return 'primary selection'
+        except (FileNotFoundError, subprocess.TimeoutExpired):
+            pass
+    
+    # macOS and Windows have a single clipboard, so save the text where the archived photos go
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    name = f"text_{info['time'].replace(':', '')}_{info['device'].replace(' ', '')}_{secrets.token_hex(2)}.txt"
+    text_path = os.path.join(ARCHIVE_DIR, name)
+    with open(text_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return text_path
+
+
+def archive_photo(image_path, info):
+    """Keep a copy of every pasted photo in ARCHIVE_DIR"""
+    with open(image_path, 'rb') as f:
+        extension = '.jpg' if f.read(2) == b'\xff\xd8' else '.png'
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    name = f"photo_{info['time'].replace(':', '')}_{info['device'].replace(' ', '')}_{secrets.token_hex(2)}{extension}"
+    shutil.copyfile(image_path, os.path.join(ARCHIVE_DIR, name))
+
+
+def exif_orientation(tiff):
+    """Orientation tag from an EXIF TIFF block, or None"""
+    order = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if order is None or len(tiff) < 8:
+        return None
+    ifd = struct.unpack(order + 'I', tiff[4:8])[0]
+    if ifd + 2 > len(tiff):
+        return None
+    count = struct.unpack(order + 'H', tiff[ifd:ifd + 2])[0]
+    for i in range(count):
+        entry = ifd + 2 + 12 * i
+        if entry + 10 > len(tiff):
+            break
+        if struct.unpack(order + 'H', tiff[entry:entry + 2])[0] == 0x0112:
+            return struct.unpack(order + 'H', tiff[entry + 8:entry + 10])[0]
+    return None
+
+
+def strip_jpeg_metadata(data):
+    """Drop EXIF/XMP (APP1), IPTC (APP13) and comments, keeping only the orientation"""
+    segments = []
+    orientation = None
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # Fill byte
+            pos += 1
+            continue
+        if marker == 0xDA:  # Start of scan: the rest is image data
+            segments.append(data[pos:])
+            break
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            segments.append(data[pos:pos + 2])
+            pos += 2
+            continue
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        segment = data[pos:pos + 2 + length]
+        if marker == 0xE1 and segment[4:10] == b'Exif\x00\x00':
+            orientation = exif_orientation(segment[10:])
+        elif marker not in (0xE1, 0xED, 0xFE):
+            segments.append(segment)
+        pos += 2 + length
+    
+    if orientation and orientation != 1:
+        # Keep the photo the right way up with a minimal EXIF block
+        tiff = b'MM\x00\x2a' + struct.pack('>IHHHIHHI', 8, 1, 0x0112, 3, 1, orientation, 0, 0)
+        payload = b'Exif\x00\x00' + tiff
+        exif = b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+        after_jfif = 1 if segments and segments[0][:2] == b'\xff\xe0' else 0
+        segments.insert(after_jfif, exif)
+    
+    return b'\xff\xd8' + b''.join(segments)
+
+
+def strip_png_metadata(data):
+    """Drop PNG text, EXIF and timestamp chunks"""
+    chunks = [data[:8]]
+    pos = 8
+    while pos + 12 <= len(data):
+        length = struct.unpack('>I', data[pos:pos + 4])[0]
+        chunk_type = data[pos + 4:pos + 8]
+        if chunk_type not in (b'tEXt', b'zTXt', b'iTXt', b'eXIf', b'tIME'):
+            chunks.append(data[pos:pos + 12 + length])
+        pos += 12 + length
+    return b''.join(chunks)
+
+
+def strip_metadata(image_path, info):
+    """Remove location, camera and other metadata before the photo is pasted"""
+    with open(image_path, 'rb') as f:
+        data = f.read()
+    
+    if data[:2] == b'\xff\xd8':
+        clean = strip_jpeg_metadata(data)
+    elif data[:8] == b'\x89PNG\r\n\x1a\n':
+        clean = strip_png_metadata(data)
+    else:
+        raise ValueError("not a JPEG or PNG, so its metadata can't be removed")
+    if clean is None:
+        raise ValueError("couldn't read the JPEG, so its metadata can't be removed")
+    
+    root, extension = os.path.splitext(image_path)
+    clean_path = f"{root}_clean{extension}"
+    with open(clean_path, 'wb') as f:
+        f.write(clean)
+    return clean_path
+
+
+def ocr_photo(image_path, info):
+    """Read the text in the photo with Tesseract and make it pasteable too"""
+    result = subprocess.run(
+        ['tesseract', image_path, 'stdout'],
+        capture_output=True,
+        text=True,
+        timeout=info['timeout']
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or "tesseract failed")
+    text = result.stdout.strip()
+    if text:
+        print(f"🔤 Text from photo ({len(text)} chars) → {copy_text_to_clipboard(text, info)}")
+
+
+def call_webhook(image_path, info):
+    """Tell a local service (WEBHOOK_URL) about the paste"""
+    body = json.dumps(dict(info, path=image_path)).encode('utf-8')
+    request = urllib.request.Request(WEBHOOK_URL, data=body, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=info['timeout']) as response:
+        response.read()
+
+
+class Stage:
+    """A post-processing step. func(image_path, info) may return a replacement image path."""
+    
+    def __init__(self, name, func, phase='after', executor='thread', timeout=30):
+        self.name = name
+        self.func = func
+        self.phase = phase  # 'before' or 'after' the clipboard commit
+        self.executor = executor  # 'thread', or 'process' for CPU-bound work
+        self.timeout = timeout
+    
+    def configured(self, phase=None, timeout=None):
+        return Stage(self.name, self.func, phase or self.phase, self.executor,
+                     timeout if timeout is not None else self.timeout)
+
+
+STAGES = {
+    'strip_metadata': Stage('strip_metadata', strip_metadata, 'before', 'process', 10),
+    'archive': Stage('archive', archive_photo, 'after', 'thread', 30),
+    'ocr': Stage('ocr', ocr_photo, 'after', 'thread', 60),
+    'webhook': Stage('webhook', call_webhook, 'after', 'thread', 10),
+}
+
+PIPELINE = []  # Filled from PIPELINE_SPEC by main()
+stage_pools = {}  # (phase, executor kind) -> pool, so slow 'after' work never queues ahead of a paste
+stage_pool_users = {}  # pool -> stage runs still using it, so a retired pool is only stopped once they finish
+stage_pools_lock = threading.Lock()
+
+
+def load_pipeline(spec):
+    """Parse 'name[:before|after[:timeout]],...' into Stages, skipping bad entries"""
+    pipeline = []
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, rest = entry.partition(':')
+        phase, _, timeout = rest.partition(':')
+        stage = STAGES.get(name)
+        if stage is None or phase not in ('', 'before', 'after'):
+            print(f"⚠️  Unknown pipeline stage: {entry}")
+            continue
+        try:
+            pipeline.append(stage.configured(phase or None, float(timeout) if timeout else None))
+        except ValueError:
+            print(f"⚠️  Bad timeout for pipeline stage: {entry}")
+    return pipeline
+
+
+def acquire_stage_pool(phase, kind):
+    """The phase's pool for this executor kind, counted as in use until release_stage_pool()"""
+    with stage_pools_lock:
+        key = (phase, kind)
+        if key not in stage_pools:
+            if kind == 'process':
+                stage_pools[key] = concurrent.futures.ProcessPoolExecutor(max_workers=STAGE_WORKERS)
+            else:
+                stage_pools[key] = concurrent.futures.ThreadPoolExecutor(max_workers=STAGE_WORKERS)
+            stage_pool_users[stage_pools[key]] = 0
+        pool = stage_pools[key]
+        stage_pool_users[pool] += 1
+        return pool
+
+
+def retire_stage_pool(phase, kind, pool, stage_name):
+    """Send later pastes to a fresh pool; this one stops once every run still using it is done"""
+    with stage_pools_lock:
+        if stage_pools.get((phase, kind)) is pool:
+            del stage_pools[(phase, kind)]
+            print(f"⚠️  {stage_name}: later pastes use a fresh worker")
+
+
+def release_stage_pool(kind, pool):
+    """Stop a retired pool once nobody is waiting on it, so other pastes' stages are never cut short"""
+    with stage_pools_lock:
+        stage_pool_users[pool] -= 1
+        if stage_pool_users[pool] or pool in stage_pools.values():
+            return
+        del stage_pool_users[pool]
+    
+    if kind == 'process':
+        # Whatever is still running here was given up on, so it can be killed (terminate_workers() is Python 3.14+)
+        if hasattr(pool, 'terminate_workers'):
+            pool.terminate_workers()
+        else:
+            for process in list((getattr(pool, '_processes', None) or {}).values()):
+                process.terminate()
+    # Threads can't be killed; an abandoned one finishes on its own
+    pool.shutdown(wait=False)
+
+
+def wait_until_started(future):
+    """Block until a pool worker picks the stage up, so its timeout covers only its own run"""
+    while not (future.running() or future.done()):
+        time.sleep(0.01)
+
+
+def run_stage(phase, stage, image_path, info):
+    """Run one stage in its pool with its timeout. Returns (new image path or None, error)."""
+    pool = acquire_stage_pool(phase, stage.executor)
+    future = None
+    try:
+        future = pool.submit(stage.func, image_path, dict(info, timeout=stage.timeout))
+        wait_until_started(future)
+        start = time.time()
+        new_path = future.result(timeout=stage.timeout)
+        print(f"⏱️  {stage.name}: {(time.time() - start) * 1000:.0f} ms")
+        return new_path, None
+    except concurrent.futures.TimeoutError:
+        retire_stage_pool(phase, stage.executor, pool, stage.name)
+        return None, f"timed out after {stage.timeout:g} s"
+    except concurrent.futures.process.BrokenProcessPool:
+        retire_stage_pool(phase, stage.executor, pool, stage.name)
+        return None, "its worker process died"
+    except RuntimeError as e:
+        if future is None:  # The pool was shut down (server stopping) before submit()
+            retire_stage_pool(phase, stage.executor, pool, stage.name)
+        return None, str(e) or type(e).__name__
+    except Exception as e:
+        return None, str(e) or type(e).__name__
+    finally:
+        release_stage_pool(stage.executor, pool)
+
+
+def run_stages(phase, image_path, info):
+    """Run this phase's stages in order. Returns (final image path, error)."""
+    for stage in PIPELINE:
+        if stage.phase != phase:
+            continue
+        new_path, error = run_stage(phase, stage, image_path, info)
+        if error:
+            print(f"❌ {stage.name} failed: {error}")
+            if phase == 'before':  # e.g. metadata that couldn't be stripped must not reach the clipboard
+                return image_path, f"{stage.name} {error}"
+        elif new_path:
+            image_path = new_path
+    return image_path, None
+
+
+def start_after_stages(image_path, info):
+    """Finish the 'after' stages in the background; the phone already has its answer"""
+    if any(stage.phase == 'after' for stage in PIPELINE):
+        threading.Thread(target=run_stages, args=('after', image_path, info), daemon=True).start()
+
+
+# Image pipeline that runs in a Web Worker on the phone, so decoding and
+# re-encoding full-resolution photos never blocks the shutter/crop UI.
+WORKER_JS = r'''
+const PREVIEW_MAX = 1280;
+
+async function decode(blob) {
+    // Apply EXIF orientation so pixels match what <img> shows
+    try {
+        return await createImageBitmap(blob, { imageOrientation: 'from-image' });
+    } catch (e) {
+        return await createImageBitmap(blob);
+    }
+}
+
+function draw(width, height) {
+    const canvas = new OffscreenCanvas(width, height);
+    return { canvas, ctx: canvas.getContext('2d') };
+}
+
+async function preview(file, maxSize) {
+    const bitmap = await decode(file);
+    const size = { width: bitmap.width, height: bitmap.height };
+    const scale = Math.min(1, (maxSize || PREVIEW_MAX) / Math.max(size.width, size.height));
+    const { canvas, ctx } = draw(Math.round(size.width * scale), Math.round(size.height * scale));
+    ctx.drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+    bitmap.close();
+    const blob = await canvas.convertToBlob({ type: 'image/jpeg', quality: 0.85 });
+    return { blob, size };
+}
+
+async function transform(file, rotation, crop, maxSize, quality) {
+    let source = await decode(file);
+
+    if (crop) {
+        const { canvas, ctx } = draw(Math.round(crop.width), Math.round(crop.height));
+        ctx.drawImage(source, crop.x, crop.y, crop.width, crop.height, 0, 0, canvas.width, canvas.height);
+        source.close();
+        source = canvas.transferToImageBitmap();
+    }
+
+    // Downscale for the network quality tier, if asked
+    const scale = maxSize ? Math.min(1, maxSize / Math.max(source.width, source.height)) : 1;
+    const width = Math.round(source.width * scale);
+    const height = Math.round(source.height * scale);
+
+    const swap = rotation === 90 || rotation === 270;
+    const { canvas, ctx } = draw(swap ? height : width, swap ? width : height);
+    ctx.translate(canvas.width / 2, canvas.height / 2);
+    ctx.rotate(rotation * Math.PI / 180);
+    ctx.drawImage(source, -width / 2, -height / 2, width, height);
+    source.close();
+
+    const type = quality ? 'image/jpeg' : 'image/png';
+    return { blob: await canvas.convertToBlob({ type, quality: quality || undefined }) };
+}
+
+self.onmessage = async (e) => {
+    const { id, op, file, rotation, crop, maxSize, quality } = e.data;
+    try {
+        const result = op === 'preview'
+            ? await preview(file, maxSize)
+            : await transform(file, rotation || 0, crop || null, maxSize || 0, quality || 0);
+        self.postMessage({ id, ok: true, result });
+    } catch (err) {
+        self.postMessage({ id, ok: false, error: String((err && err.message) || err) });
+    }
+};
+'''
+WORKER_ETAG = '"' + hashlib.sha1(WORKER_JS.encode('utf-8')).hexdigest()[:16] + '"'
+
+
+class ClipboardHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        try:
+            path = self.path.split('?', 1)[0]
+            if path == '/pair':
+                self.handle_pair()
+                return
+            if path == '/pair/code':
+                self.handle_pairing_code()
+                return
             
-            # Copy to clipboard (cross-platform)
-            success, error = copy_image_to_clipboard(temp_path)
+            # Checked on the headers alone, so an unpaired phone's body is never read
+            device = self.require_device()
+            if device is None:
+                return
             
-            if success:
-                print(f"✅ Photo copied to clipboard! ({len(image_data)} bytes)")
-                self.send_response(200)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(b"Photo copied to clipboard!")
+            if path == '/stage':
+                self.handle_stage(device)
+            elif path == '/commit':
+                self.handle_commit(device)
+            elif path == '/probe':
+                self.handle_probe_upload()
             else:
-                print(f"❌ Error: {error}")
-                self.send_error(500, f"Clipboard error: {error}")
+                self.handle_upload(device)
                 
         except Exception as e:
             print(f"❌ Error: {e}")
             self.send_error(500, str(e))
     
+    def require_device(self):
+        """The paired phone making this request, or None after sending a 401"""
+        device = find_device(self.headers.get('X-Device-Token'))
+        if device is None:
+            self.send_error(401, "Phone not paired")
+        return device
+    
+    def handle_pairing_code(self):
+        """An unpaired phone wants to pair: show a code on the computer if none is active"""
+        error = request_pairing_code()
+        if error:
+            self.send_error(403, error)
+            return
+        self.send_response(204)
+        self.end_headers()
+    
+    def handle_pair(self):
+        """Trade the pairing code shown on the computer for a device token"""
+        if int(self.headers.get('Content-Length', 0)) > 1024:
+            self.send_error(413, "Pairing request too large")
+            return
+        
+        body = self.read_body()
+        if body is None:
+            return
+        
+        try:
+            code = json.loads(body)['code']
+        except (ValueError, TypeError, KeyError):
+            self.send_error(400, "Invalid pairing request")
+            return
+        
+        device, error = pair_device(code)
+        if device is None:
+            print(f"🔑 {error}")
+            self.send_error(403, error)
+            return
+        
+        print(f"🔗 Paired {device.name}")
+        self.send_json({'token': device.token, 'name': device.name})
+    
+    def read_body(self):
+        """Read the request body, or send a 400 and return None if it is empty"""
+        content_length = int(self.headers.get('Content-Length', 0))
+        
+        if content_length == 0:
+            self.send_error(400, "No image data received")
+            return None
+        
+        return self.rfile.read(content_length)
+    
+    def handle_upload(self, device):
+        """Receive a finished photo and copy it to the clipboard"""
+        image_data = self.read_body()
+        if image_data is None:
+            return
+        
+        # Save to temp file
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        temp_path = os.path.join(tempfile.gettempdir(), f"clipboard_photo_{timestamp}_{secrets.token_hex(4)}.png")
+        
+        with open(temp_path, 'wb') as f:
+            f.write(image_data)
+        
+        self.paste(device, temp_path, len(image_data))
+    
+    def handle_stage(self, device):
+        """Receive the original photo in the background, before the user taps Send"""
+        image_data = self.read_body()
+        if image_data is None:
+            return
+        
+        upload_id = stage_upload(device, image_data)
+        print(f"📥 Photo from {device.name} staged ({len(image_data)} bytes){self.quality_note()}")
+        self.send_json({'id': upload_id})
+    
+    def handle_commit(self, device):
+        """Apply the user's rotation/crop to a staged photo and copy it to the clipboard"""
+        body = self.read_body()
+        if body is None:
+            return
+        
+        try:
+            params = json.loads(body)
+            rotation = int(params.get('rotation') or 0)
+            crop = params.get('crop')
+            if crop:
+                crop = {key: max(0, int(round(crop[key]))) for key in ('x', 'y', 'width', 'height')}
+        except (ValueError, TypeError, KeyError, AttributeError, OverflowError):
+            self.send_error(400, "Invalid commit")
+            return
+        
+        if rotation not in (0, 90, 180, 270):
+            self.send_error(400, "Invalid rotation")
+            return
+        
+        image_path = take_staged_upload(device, str(params.get('id')))
+        if image_path is None:
+            # The page falls back to uploading the finished photo
+            self.send_error(404, "Upload expired")
+            return
+        
+        if rotation or crop:
+            edited_path, error = transform_image(image_path, rotation, crop)
+            remove_file(image_path)
+            if edited_path is None:
+                print(f"⚠️  Could not edit photo: {error}")
+                self.send_error(501, f"Edit error: {error}")
+                return
+            image_path = edited_path
+        
+        self.paste(device, image_path, os.path.getsize(image_path))
+    
+    def paste(self, device, image_path, size):
+        """Copy a saved photo to the clipboard (in the phone's turn) and send the result"""
+        info = {'device': device.name, 'time': datetime.now().isoformat(timespec='seconds'), 'bytes': size}
+        original_path = image_path
+        image_path, error = run_stages('before', image_path, info)
+        if error:
+            remove_file(original_path)
+            remove_file(image_path)
+            self.send_error(500, f"Photo not pasted: {error}")
+            return
+        
+        job = submit_commit(device, image_path, size)
+        job.done.wait()
+        success, error = job.success, job.error
+        
+        if success:
+            print(f"✅ Photo from {device.name} copied to clipboard! ({size} bytes){self.quality_note()}")
+            self.send_response(200)
+            self.send_header('Content-type', 'text/plain')
+            self.end_headers()
+            self.wfile.write(b"Photo copied to clipboard!")
+            start_after_stages(image_path, info)
+        else:
+            print(f"❌ Error: {error}")
+            self.send_error(500, f"Clipboard error: {error}")
+    
+    def quality_note(self):
+        """The quality tier the phone picked and the throughput it measured, for the log"""
+        tier = self.headers.get('X-Quality-Tier')
+        if not tier:
+            return ''
+        try:
+            kbps = int(self.headers.get('X-Network-Kbps') or 0)
+        except ValueError:
+            kbps = 0
+        if not kbps:
+            return f" [{tier}, network not measured]"
+        return f" [{tier} @ {kbps / 1000:.1f} Mbit/s]"
+    
+    def handle_probe_upload(self):
+        """Receive and discard probe bytes so the phone can time its upload speed"""
+        remaining = int(self.headers.get('Content-Length', 0))
+        if remaining > PROBE_MAX_BYTES:
+            self.send_error(413, "Probe too large")
+            return
+        
+        size = remaining
+        start = time.time()
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 1 << 16))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+        elapsed_ms = max((time.time() - start) * 1000, 0.001)
+        
+        print(f"📶 Network probe: {size // 1024} KB in {elapsed_ms:.0f} ms")
+        self.send_json({'bytes': size - remaining, 'ms': round(elapsed_ms, 1)})
+    
+    def send_probe_download(self):
+        """Send N bytes (?bytes=N) for round-trip and download timing"""
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        try:
+            size = min(max(int(query.get('bytes', ['0'])[0]), 0), PROBE_MAX_BYTES)
+        except ValueError:
+            self.send_error(400, "Invalid probe size")
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        
+        chunk = bytes(min(size, 1 << 16))
+        while size > 0:
+            self.wfile.write(chunk[:size])
+            size -= len(chunk)
+    
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
     def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/worker.js':
+            self.send_worker()
+        elif path in ('/clipboard', '/probe', '/history'):
+            device = self.require_device()
+            if device is None:
+                return
+            if path == '/clipboard':
+                self.send_clipboard()
+            elif path == '/probe':
+                self.send_probe_download()
+            else:
+                self.send_history(device)
+        else:
+            self.send_page()
+    
+    def send_history(self, device):
+        """This phone's recent pastes, newest first"""
+        with devices_lock:
+            history = list(reversed(device.history))
+            queued = len(device.queue)
+        self.send_json({'name': device.name, 'queued': queued, 'history': history})
+
+    def send_worker(self):
+        """Serve the image Web Worker; the page links it by version so it caches forever"""
+        if self.headers.get('If-None-Match') == WORKER_ETAG:
+            self.send_response(304)
+            self.send_header('ETag', WORKER_ETAG)
+            self.end_headers()
+            return
+
+        body = WORKER_JS.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-type', 'application/javascript; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+        self.send_header('ETag', WORKER_ETAG)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_clipboard(self):
+        """Send the computer's clipboard image to the phone"""
+        try:
+            image_file, etag, error = get_clipboard_image()
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            self.send_error(500, str(e))
+            return
+        
+        if image_file is None:
+            self.send_error(404, error)
+            return
+        
+        with image_file:
+            self.send_clipboard_file(image_file, etag)
+    
+    def send_clipboard_file(self, image_file, etag):
+        """Send an open clipboard export, honouring If-None-Match and Range"""
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'private, no-cache')
+            self.end_headers()
+            return
+        
+        size = os.fstat(image_file.fileno()).st_size
+        start, end = 0, size - 1
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range', etag) == etag:
+            byte_range = parse_range(range_header, size)
+            if byte_range is None:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            start, end = byte_range
+        
+        partial = (start, end) != (0, size - 1)
+        self.send_response(206 if partial else 200)
+        self.send_header('Content-type', 'image/png')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if partial:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'private, no-cache')
+        self.end_headers()
+        
+        # Zero-copy from the file to the socket (os.sendfile where the OS has it)
+        self.connection.sendfile(image_file, start, end - start + 1)
+        print(f"📤 Clipboard image sent to phone ({end - start + 1} bytes)")
+    
+    def send_page(self):
         """Serve the camera capture page"""
         self.send_response(200)
         self.send_header('Content-type', 'text/html; charset=utf-8')
         self.end_headers()
-        
+
         html = '''<!DOCTYPE html>
 <html lang="en">
 <head>
@@ -330,6 +1435,10 @@ class ClipboardHandler(http.server.BaseHTTPRequestHandler):
             background: #e0e0e0;
         }
         
+        .rotate-btn:disabled {
+            opacity: 0.4;
+        }
+        
         .send-btn {
             background: #222;
             border: none;
@@ -340,6 +1449,14 @@ class ClipboardHandler(http.server.BaseHTTPRequestHandler):
             background: #444;
         }
         
+        a.send-btn {
+            text-decoration: none;
+        }
+        
+        .pull-link {
+            margin-top: 8px;
+        }
+        
         #preview {
             transition: transform 0.2s ease;
         }
@@ -426,6 +1543,10 @@ class ClipboardHandler(http.server.BaseHTTPRequestHandler):
             <button class="send-btn" id="sendBtn">Send</button>
         </div>
         
+        <div class="controls" id="pullControls" style="display: none;">
+            <a class="send-btn" id="saveLink" download="clipboard.png">Save to phone</a>
+        </div>
+        
         <!-- Crop overlay -->
         <div id="cropOverlay" style="display: none;">
             <div class="crop-container" id="cropContainer">
@@ -450,6 +1571,7 @@ class ClipboardHandler(http.server.BaseHTTPRequestHandler):
         </div>
         
         <button class="gallery-link" id="galleryBtn">or choose from gallery</button>
+        <button class="gallery-link pull-link" id="pullBtn">↓ pull image from computer</button>
         
         <div class="hint">
             To paste on your computer:<br>
@@ -470,6 +1592,9 @@ class ClipboardHandler(http.server.BaseHTTPRequestHandler):
         const rotateBtn = document.getElementById('rotateBtn');
         const cropBtn = document.getElementById('cropBtn');
         const sendBtn = document.getElementById('sendBtn');
+        const pullBtn = document.getElementById('pullBtn');
+        const pullControls = document.getElementById('pullControls');
+        const saveLink = document.getElementById('saveLink');
         
         // Crop elements
         const cropOverlay = document.getElementById('cropOverlay');
@@ -482,6 +1607,280 @@ class ClipboardHandler(http.server.BaseHTTPRequestHandler):
         let rotation = 0;
         let previewUrl = null;
         let cropData = null;
+        let imageSize = null;
+        let loadSeq = 0;
+        
+        // Pairing: the computer shows a code, the phone trades it for a token once
+        // and sends that token with every request
+        let deviceToken = localStorage.getItem('deviceToken');
+        
+        function api(url, options) {
+            options = Object.assign({}, options);
+            options.headers = Object.assign({ 'X-Device-Token': deviceToken || '' }, options.headers);
+            return fetch(url, options).then((res) => {
+                if (res.status === 401) forgetPairing();
+                return res;
+            });
+        }
+        
+        function forgetPairing() {
+            deviceToken = null;
+            localStorage.removeItem('deviceToken');
+        }
+        
+        async function ensurePaired() {
+            if (deviceToken) return true;
+            
+            try {
+                // Makes the computer show a new code if the last one expired or was used
+                const codeRes = await fetch('/pair/code', { method: 'POST' });
+                if (!codeRes.ok) {
+                    status.textContent = 'Pairing locked - restart the app on your computer';
+                    status.className = 'error';
+                    return false;
+                }
+                
+                const code = prompt('Enter the pairing code shown on your computer');
+                if (!code) return false;
+                
+                const res = await fetch('/pair', {
+                    method: 'POST',
+                    body: JSON.stringify({ code: code.trim() }),
+                    headers: { 'Content-Type': 'application/json' }
+                });
+                if (!res.ok) {
+                    status.textContent = 'Pairing failed - check your computer';
+                    status.className = 'error';
+                    return false;
+                }
+                deviceToken = (await res.json()).token;
+                localStorage.setItem('deviceToken', deviceToken);
+                status.textContent = '✓ Paired';
+                status.className = 'success';
+                scheduleProbe();
+                return true;
+            } catch (e) {
+                status.textContent = 'No connection';
+                status.className = 'error';
+                return false;
+            }
+        }
+        
+        // Adaptive quality: a background probe measures the Wi-Fi link, and each photo
+        // is sent at the best tier that should still arrive within TARGET_SEND_MS
+        const TARGET_SEND_MS = 1000;
+        const PROBE_BYTES = 256 * 1024;
+        const PROBE_MAX_AGE = 5 * 60 * 1000;
+        const QUALITY_TIERS = [
+            { name: 'original', maxSize: 0, quality: 0, bytesPerPixel: 0 },
+            { name: 'high', maxSize: 2560, quality: 0.9, bytesPerPixel: 0.35 },
+            { name: 'medium', maxSize: 1920, quality: 0.8, bytesPerPixel: 0.2 },
+            { name: 'low', maxSize: 1280, quality: 0.7, bytesPerPixel: 0.12 }
+        ];
+        
+        let network = null;  // { rttMs, kbps, at }
+        let probing = false;
+        try {
+            network = JSON.parse(localStorage.getItem('networkEstimate'));
+        } catch (e) {
+            network = null;
+        }
+        
+        async function probeNetwork() {
+            if (probing) return;
+            probing = true;
+            try {
+                let start = performance.now();
+                const ping = await api('/probe?bytes=0', { cache: 'no-store' });
+                if (!ping.ok) return;
+                await ping.arrayBuffer();
+                const rttMs = performance.now() - start;
+                
+                start = performance.now();
+                const upload = await api('/probe', { method: 'POST', body: new Uint8Array(PROBE_BYTES) });
+                if (!upload.ok) return;
+                await upload.json();
+                const uploadMs = Math.max(1, performance.now() - start - rttMs);
+                
+                // bits per millisecond = kbit/s
+                network = { rttMs, kbps: PROBE_BYTES * 8 / uploadMs, at: Date.now() };
+                localStorage.setItem('networkEstimate', JSON.stringify(network));
+            } finally {
+                probing = false;
+            }
+        }
+        
+        function scheduleProbe() {
+            if (!deviceToken) return;
+            if (network && Date.now() - network.at < PROBE_MAX_AGE) return;
+            setTimeout(() => probeNetwork().catch(() => {}), 500);
+        }
+        
+        function tierScale(tier, size) {
+            return tier.maxSize ? Math.min(1, tier.maxSize / Math.max(size.width, size.height)) : 1;
+        }
+        
+        function estimateSendMs(tier, file, size) {
+            const scale = tierScale(tier, size);
+            const bytes = tier.quality ? size.width * size.height * scale * scale * tier.bytesPerPixel : file.size;
+            return network.rttMs + bytes * 8 / network.kbps;
+        }
+        
+        // Downscaling needs the worker; without it (or a measurement) send the original
+        function pickTier(file, size) {
+            if (!network || !size || !imageWorker) return QUALITY_TIERS[0];
+            return QUALITY_TIERS.find((tier) => estimateSendMs(tier, file, size) <= TARGET_SEND_MS)
+                || QUALITY_TIERS[QUALITY_TIERS.length - 1];
+        }
+        
+        function uploadHeaders(blob, tier) {
+            return {
+                'Content-Type': blob.type || 'image/png',
+                'X-Quality-Tier': tier.name,
+                'X-Network-Kbps': network ? String(Math.round(network.kbps)) : '0'
+            };
+        }
+        
+        scheduleProbe();
+        window.addEventListener('online', () => { network = null; scheduleProbe(); });
+        document.addEventListener('visibilitychange', () => {
+            if (document.visibilityState === 'visible') scheduleProbe();
+        });
+        if (navigator.connection && navigator.connection.addEventListener) {
+            navigator.connection.addEventListener('change', () => { network = null; scheduleProbe(); });
+        }
+        
+        // The photo is uploaded in the background as soon as it is picked; Send then
+        // only commits the edits (crop in original pixels, then rotation)
+        let staged = null;
+        let editCrop = null;
+        
+        function stageUpload(file, ready) {
+            const promise = ready
+                .then(async (result) => {
+                    const { blob, tier } = await encodeForTier(file, pickTier(file, result.size), 0);
+                    const res = await api('/stage', {
+                        method: 'POST',
+                        body: blob,
+                        headers: uploadHeaders(blob, tier)
+                    });
+                    if (!res.ok) return null;
+                    // Staged pixels may be downscaled, so crops are scaled to match
+                    return { id: (await res.json()).id, scale: tierScale(tier, result.size) };
+                })
+                .catch(() => null);
+            staged = { file, promise };
+        }
+        
+        // Returns the commit response, or null if the page must upload the photo itself
+        async function commitStaged() {
+            if (!staged) return null;
+            const pending = staged;
+            staged = null;
+            
+            const upload = await pending.promise;
+            if (!upload) return null;
+            
+            const crop = editCrop && {
+                x: editCrop.x * upload.scale,
+                y: editCrop.y * upload.scale,
+                width: editCrop.width * upload.scale,
+                height: editCrop.height * upload.scale
+            };
+            const res = await api('/commit', {
+                method: 'POST',
+                body: JSON.stringify({ id: upload.id, rotation, crop }),
+                headers: { 'Content-Type': 'application/json' }
+            });
+            // Expired upload or no image editor on the computer
+            if (res.status === 404 || res.status === 501) return null;
+            return res;
+        }
+        
+        // Decode/transform/encode off the main thread when the browser can
+        let imageWorker = null;
+        let workerSeq = 0;
+        const workerJobs = new Map();
+        
+        if ('Worker' in window && 'OffscreenCanvas' in window && 'createImageBitmap' in window) {
+            try {
+                imageWorker = new Worker('/worker.js?v=__WORKER_VERSION__');
+                imageWorker.onmessage = (e) => {
+                    const job = workerJobs.get(e.data.id);
+                    if (!job) return;
+                    workerJobs.delete(e.data.id);
+                    if (e.data.ok) job.resolve(e.data.result);
+                    else job.reject(new Error(e.data.error));
+                };
+                imageWorker.onerror = () => disableWorker();
+            } catch (e) {
+                imageWorker = null;
+            }
+        }
+        
+        function disableWorker() {
+            if (imageWorker) imageWorker.terminate();
+            imageWorker = null;
+            workerJobs.forEach((job) => job.reject(new Error('Worker unavailable')));
+            workerJobs.clear();
+        }
+        
+        function runInWorker(message) {
+            return new Promise((resolve, reject) => {
+                const id = ++workerSeq;
+                workerJobs.set(id, { resolve, reject });
+                imageWorker.postMessage(Object.assign({ id }, message));
+            });
+        }
+        
+        // A rejected job (e.g. a format createImageBitmap can't decode) only falls back
+        // for that call; the worker is dropped only if the worker itself fails
+        
+        // Downscaled preview for the page and crop overlay, plus full-size dimensions
+        async function makePreview(file) {
+            if (imageWorker) {
+                try {
+                    return await runInWorker({ op: 'preview', file });
+                } catch (e) {
+                    // Fall back to the full image on the main thread
+                }
+            }
+            return { blob: file, size: null };
+        }
+        
+        // Apply crop (first) and rotation, returning a new PNG blob
+        async function transformImage(file, options) {
+            const rotation = options.rotation || 0;
+            const crop = options.crop || null;
+            if (imageWorker) {
+                try {
+                    return (await runInWorker({ op: 'transform', file, rotation, crop })).blob;
+                } catch (e) {
+                    // Fall back to the main-thread canvas
+                }
+            }
+            let blob = file;
+            if (crop) blob = await cropImage2(blob, crop);
+            if (rotation !== 0) blob = await rotateImage(blob, rotation);
+            return blob;
+        }
+        
+        // Rotate and encode for a quality tier. Only the worker can downscale, so if it
+        // can't, the full-size photo is returned with the 'original' tier.
+        async function encodeForTier(file, tier, rotation) {
+            if (imageWorker && tier.quality) {
+                try {
+                    const result = await runInWorker({
+                        op: 'transform', file, rotation, maxSize: tier.maxSize, quality: tier.quality
+                    });
+                    return { blob: result.blob, tier };
+                } catch (e) {
+                    // Fall through to the full-size photo
+                }
+            }
+            const blob = rotation !== 0 ? await transformImage(file, { rotation }) : file;
+            return { blob, tier: QUALITY_TIERS[0] };
+        }
         
         shutterBtn.onclick = () => camera.click();
         galleryBtn.onclick = () => gallery.click();
@@ -497,28 +1896,68 @@ class ClipboardHandler(http.server.BaseHTTPRequestHandler):
             cleanup();
             currentFile = null;
             rotation = 0;
+            imageSize = null;
+            staged = null;
+            editCrop = null;
+            loadSeq++;
             preview.style.display = 'none';
             preview.style.transform = 'rotate(0deg)';
             preview.src = '';
             placeholder.style.display = 'block';
             controls.style.display = 'none';
+            pullControls.style.display = 'none';
         }
         
+        // Rotate/crop need the preview and its size, so they wait for the decode
+        function setEditing(enabled) {
+            rotateBtn.disabled = !enabled;
+            cropBtn.disabled = !enabled;
+        }
+        
+        async function showPreview(file, ready) {
+            const seq = ++loadSeq;
+            setEditing(false);
+            const result = await (ready || makePreview(file));
+            if (seq !== loadSeq) return;
+            
+            cleanup();
+            imageSize = result.size;
+            previewUrl = URL.createObjectURL(result.blob);
+            preview.src = previewUrl;
+            preview.style.display = 'block';
+            preview.style.transform = `rotate(${rotation}deg)`;
+            setEditing(true);
+        }
+        
+        // Without the worker the preview is the full image, so read its size here
+        preview.onload = () => {
+            if (!imageSize) {
+                imageSize = { width: preview.naturalWidth, height: preview.naturalHeight };
+            }
+        };
+        
         function loadImage(file) {
             if (!file) return;
             
+            // Drop the previous photo's preview so nothing edits it by mistake
             cleanup();
+            imageSize = null;
+            preview.style.display = 'none';
+            preview.removeAttribute('src');
+            
             currentFile = file;
             rotation = 0;
+            editCrop = null;
+            const ready = makePreview(file);
+            staged = null;
+            if (deviceToken) stageUpload(file, ready);
             
-            previewUrl = URL.createObjectURL(file);
-            preview.src = previewUrl;
-            preview.style.display = 'block';
-            preview.style.transform = 'rotate(0deg)';
             placeholder.style.display = 'none';
             controls.style.display = 'flex';
+            pullControls.style.display = 'none';
             status.textContent = '';
             status.className = '';
+            showPreview(file, ready);
         }
         
         rotateBtn.onclick = () => {
@@ -528,7 +1967,7 @@ class ClipboardHandler(http.server.BaseHTTPRequestHandler):
         
         // Crop functionality
         cropBtn.onclick = () => {
-            if (!currentFile) return;
+            if (!currentFile || !previewUrl) return;
             cropImage.src = previewUrl;
             cropOverlay.style.display = 'flex';
             
@@ -551,9 +1990,10 @@ class ClipboardHandler(http.server.BaseHTTPRequestHandler):
             const imgRect = cropImage.getBoundingClientRect();
             const boxRect = cropBox.getBoundingClientRect();
             
-            // Calculate crop ratios relative to displayed image
-            const scaleX = cropImage.naturalWidth / imgRect.width;
-            const scaleY = cropImage.naturalHeight / imgRect.height;
+            // Calculate crop ratios relative to displayed image (the preview may be downscaled)
+            const size = imageSize || { width: cropImage.naturalWidth, height: cropImage.naturalHeight };
+            const scaleX = size.width / imgRect.width;
+            const scaleY = size.height / imgRect.height;
             
             cropData = {
                 x: (boxRect.left - imgRect.left) * scaleX,
@@ -562,17 +2002,26 @@ class ClipboardHandler(http.server.BaseHTTPRequestHandler):
                 height: boxRect.height * scaleY
             };
             
-            // Apply crop to current file
-            currentFile = await cropImage2(currentFile, cropData);
+            cropOverlay.style.display = 'none';
+            status.textContent = 'Cropping...';
+            status.className = 'loading';
             
-            // Update preview
-            cleanup();
-            previewUrl = URL.createObjectURL(currentFile);
-            preview.src = previewUrl;
-            preview.style.transform = 'rotate(0deg)';
+            // Crops stack, so keep the total crop relative to the staged original
+            editCrop = editCrop ? {
+                x: editCrop.x + cropData.x,
+                y: editCrop.y + cropData.y,
+                width: cropData.width,
+                height: cropData.height
+            } : cropData;
+            
+            // Apply crop to current file
+            currentFile = await transformImage(currentFile, { crop: cropData });
             rotation = 0;
             
-            cropOverlay.style.display = 'none';
+            // Update preview
+            await showPreview(currentFile);
+            status.textContent = '';
+            status.className = '';
         };
         
         // Make crop box draggable and resizable
@@ -664,24 +2113,25 @@ class ClipboardHandler(http.server.BaseHTTPRequestHandler):
         
         sendBtn.onclick = async () => {
             if (!currentFile) return;
+            if (!await ensurePaired()) return;
             
             sendBtn.disabled = true;
             status.textContent = 'Sending...';
             status.className = 'loading';
             
             try {
-                let blob = currentFile;
+                let res = await commitStaged().catch(() => null);
                 
-                if (rotation !== 0) {
-                    blob = await rotateImage(currentFile, rotation);
+                if (!res) {
+                    const { blob, tier } = await encodeForTier(currentFile, pickTier(currentFile, imageSize), rotation);
+                    
+                    res = await api(location.href, {
+                        method: 'POST',
+                        body: blob,
+                        headers: uploadHeaders(blob, tier)
+                    });
                 }
                 
-                const res = await fetch(location.href, {
-                    method: 'POST',
-                    body: blob,
-                    headers: { 'Content-Type': 'image/png' }
-                });
-                
                 if (res.ok) {
                     status.textContent = '✓ Copied!';
                     status.className = 'success';
@@ -691,7 +2141,7 @@ class ClipboardHandler(http.server.BaseHTTPRequestHandler):
                     controls.style.display = 'none';
                     currentFile = null;
                 } else {
-                    status.textContent = 'Failed - tap to retry';
+                    status.textContent = res.status === 401 ? 'Pair this phone again' : 'Failed - tap to retry';
                     status.className = 'error';
                 }
             } catch (e) {
@@ -743,11 +2193,50 @@ class ClipboardHandler(http.server.BaseHTTPRequestHandler):
             });
         }
         
+        // Pull the computer's clipboard image. The browser revalidates with the
+        // ETag, so pulling an unchanged clipboard again is a single 304.
+        pullBtn.onclick = async () => {
+            if (!await ensurePaired()) return;
+            
+            pullBtn.disabled = true;
+            status.textContent = 'Pulling...';
+            status.className = 'loading';
+            
+            try {
+                const res = await api('/clipboard', { cache: 'no-cache' });
+                if (!res.ok) {
+                    status.textContent = res.status === 404 ? 'No image on computer clipboard'
+                        : res.status === 401 ? 'Pair this phone again' : 'Pull failed';
+                    status.className = 'error';
+                    return;
+                }
+                const blob = await res.blob();
+                
+                resetUI();
+                previewUrl = URL.createObjectURL(blob);
+                preview.src = previewUrl;
+                preview.style.display = 'block';
+                placeholder.style.display = 'none';
+                saveLink.href = previewUrl;
+                pullControls.style.display = 'flex';
+                status.textContent = '↓ Pulled from computer';
+                status.className = 'success';
+            } catch (e) {
+                status.textContent = 'No connection';
+                status.className = 'error';
+            } finally {
+                pullBtn.disabled = false;
+            }
+        };
+        
+        if (!deviceToken) setTimeout(ensurePaired, 300);
+        
         camera.onchange = (e) => { loadImage(e.target.files[0]); e.target.value = ''; };
         gallery.onchange = (e) => { loadImage(e.target.files[0]); e.target.value = ''; };
     </script>
 </body>
 </html>'''
+        html = html.replace('__WORKER_VERSION__', WORKER_ETAG.strip('"'))
         self.wfile.write(html.encode('utf-8'))
     
     def log_message(self, format, *args):
@@ -767,7 +2256,45 @@ def get_local_ip():
         return "localhost"
 
 
+def expire_staged_loop():
+    """Periodically drop photos that were uploaded but never sent"""
+    while True:
+        time.sleep(60)
+        expire_staged_uploads()
+
+
+def manage_devices(args):
+    """`server.py --devices` lists paired phones; `server.py --unpair NAME|all` removes them.
+    A running server notices the change on its next request."""
+    sync_devices()
+    if args[0] == '--devices':
+        for device in devices.values():
+            print(device.name)
+        if not devices:
+            print("No paired phones")
+        return 0
+    
+    if args[0] == '--unpair' and len(args) == 2:
+        name = args[1]
+        with devices_lock:
+            removed = [token for token, device in devices.items() if name in ('all', device.name)]
+            for token in removed:
+                del devices[token]
+        if not removed:
+            print(f"No paired phone called {name!r} (see --devices)")
+            return 1
+        save_devices()
+        print(f"🔌 Unpaired {len(removed)} phone(s)")
+        return 0
+    
+    print("Usage: server.py [--devices | --unpair NAME | --unpair all]")
+    return 2
+
+
 def main():
+    if len(sys.argv) > 1:
+        sys.exit(manage_devices(sys.argv[1:]))
+    
     local_ip = get_local_ip()
     
     print("\n" + "="*50)
@@ -775,17 +2302,30 @@ def main():
     print("="*50)
     print(f"\n🌐 Server running at: http://{local_ip}:{PORT}")
     print(f"\n📱 Open this URL on your phone's browser")
+    print(f"\n🔑 Pairing code: {new_pairing_code()} (pairs one phone, valid {PAIRING_WINDOW // 60} min)")
+    PIPELINE[:] = load_pipeline(PIPELINE_SPEC)
+    if PIPELINE:
+        print("\n🔧 Pipeline: " + ", ".join(f"{stage.name} ({stage.phase})" for stage in PIPELINE))
     print("\n" + "="*50)
     print("Waiting for photos...\n")
     
-    server = http.server.HTTPServer(('0.0.0.0', PORT), ClipboardHandler)
+    # Threaded, so background uploads are handled while the page keeps talking to us
+    server = http.server.ThreadingHTTPServer(('0.0.0.0', PORT), ClipboardHandler)
     server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     
+    sync_devices()
+    if os.path.exists(DEVICES_FILE):
+        save_devices()  # Rewrites the file as owner-only if an older version left it readable
+    threading.Thread(target=commit_loop, daemon=True).start()
+    threading.Thread(target=expire_staged_loop, daemon=True).start()
+    
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         print("\n\n👋 Server stopped.")
         server.shutdown()
+        for pool in stage_pools.values():
+            pool.shutdown(wait=False)
 
 
 if __name__ == "__main__":